@@ -4,17 +4,23 @@ Flask Web App - Instagram Carousel Editor
 Browse carousels, test edits with NanaBanana, approve for ComfyUI batch processing
 """
 from flask import Flask, render_template, request, jsonify, redirect, url_for
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 import os
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
+import hashlib
+import io
+import shutil
+import tarfile
 import subprocess
-import tempfile
 import uuid
 import json
-import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 load_dotenv('.env.local')
 
@@ -24,12 +30,86 @@ app.secret_key = os.urandom(24)
 # Initialize Supabase
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Shared keep-alive pool for PostgREST + Storage calls (Flask threads and worker pools share it)
+supabase_http = httpx.Client(
+    transport=httpx.HTTPTransport(
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40, keepalive_expiry=40.0),
+        retries=3
+    ),
+    timeout=120
+)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=supabase_http))
+
+# Storage API handle for generated images - built once instead of per call
+image_bucket = supabase.storage.from_('carousel-images')
 
 # WaveSpeed NanaBanana API
 WAVESPEED_API_KEY = os.getenv('WAVESPEED_API_KEY')
 WAVESPEED_API_URL = os.getenv('WAVESPEED_API_URL')
 
+# Shared HTTP session - keeps connections to WaveSpeed, ComfyUI and image CDNs alive
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# RunPod/ComfyUI configuration
+COMFYUI_API_URL = "https://9io0dgfk3xonew-8188.proxy.runpod.net"
+RUNPOD_SSH_HOST = "203.57.40.245"
+RUNPOD_SSH_PORT = "10120"
+SSH_KEY_PATH = os.path.expanduser("~/.ssh/id_ed25519")
+
+# Background pool for approved batches (uploads + workflow submission)
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='batch')
+
+# Jobs only live in this process - a batch still 'queued' after this long lost its job
+# (e.g. the debug reloader restarted the app) and is marked failed by poll_batch
+QUEUED_BATCH_TIMEOUT = timedelta(minutes=5)
+
+# ComfyUI Workflow 2 template - read once at startup instead of on every approval
+WORKFLOW_PATH = '/workspaces/business/OpenPose Workflow 2 - Jockerai (2).json'
+try:
+    with open(WORKFLOW_PATH, 'r') as f:
+        WORKFLOW_TEMPLATE = json.load(f)
+except FileNotFoundError:
+    print(f"⚠️  Workflow template not found: {WORKFLOW_PATH}")
+    WORKFLOW_TEMPLATE = None
+
+
+def download_streamed(url, timeout=60):
+    """Download a file through the shared session in 64KB chunks"""
+    with SESSION.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        buffer = io.BytesIO()
+        shutil.copyfileobj(response.raw, buffer, length=64 * 1024)
+    return buffer.getvalue()
+
+
+def edit_prompt_hash(image_id, edit_prompt):
+    """Cache key for a NanaBanana edit of one image with one prompt"""
+    return hashlib.sha256(f"{image_id}:{edit_prompt}".encode()).hexdigest()
+
+
+def find_cached_edit(prompt_hash):
+    """Return a previous NanaBanana result URL for the same image + prompt, if any
+
+    A URL that was rejected on any edit_test is never reused, even if another
+    row pointing at it is still completed.
+    """
+    result = supabase.table('edit_tests').select('nanabana_result_url,status').eq('prompt_hash', prompt_hash).not_.is_('nanabana_result_url', 'null').execute()
+
+    rejected = {row['nanabana_result_url'] for row in result.data if row['status'] == 'rejected'}
+    for row in result.data:
+        if row['status'] in ('completed', 'approved') and row['nanabana_result_url'] not in rejected:
+            return row['nanabana_result_url']
+    return None
+
 
 @app.route('/')
 def index():
@@ -46,13 +126,19 @@ def browse_carousels():
     """Browse all Instagram carousels"""
 
     # Get all carousels, ordered by most recent
-    result = supabase.table('instagram_carousels').select('*').order('posted_at', desc=True).execute()
+    result = supabase.table('instagram_carousels').select('id,caption,image_count,likes_count,comments_count,posted_at').order('posted_at', desc=True).execute()
     carousels = result.data
 
-    # For each carousel, get first image
+    # Get images for all carousels in one query, keep first image per carousel
+    first_images = {}
+    carousel_ids = [c['id'] for c in carousels]
+    if carousel_ids:
+        images = supabase.table('carousel_images').select('id,carousel_id,image_url,local_path,image_order').in_('carousel_id', carousel_ids).order('image_order').execute()
+        for img in images.data:
+            first_images.setdefault(img['carousel_id'], img)
+
     for carousel in carousels:
-        images = supabase.table('carousel_images').select('*').eq('carousel_id', carousel['id']).order('image_order').limit(1).execute()
-        carousel['first_image'] = images.data[0] if images.data else None
+        carousel['first_image'] = first_images.get(carousel['id'])
 
     return render_template('browse.html', carousels=carousels)
 
@@ -122,7 +208,7 @@ def generate_from_model(model_id):
         return jsonify({'success': False, 'error': 'Missing required fields'}), 400
 
     # Get image
-    image = supabase.table('carousel_images').select('*').eq('id', image_id).single().execute().data
+    image = supabase.table('carousel_images').select('carousel_id,image_url,local_path').eq('id', image_id).single().execute().data
 
     # Call NanaBanana API to edit primary image
     print(f"Calling NanaBanana API with prompt: {prompt}")
@@ -145,7 +231,7 @@ def generate_from_model(model_id):
     }
 
     try:
-        response = requests.post(WAVESPEED_API_URL, json=payload, headers=headers, timeout=120)
+        response = SESSION.post(WAVESPEED_API_URL, json=payload, headers=headers, timeout=120)
         response.raise_for_status()
 
         result = response.json()
@@ -166,6 +252,7 @@ def generate_from_model(model_id):
         'carousel_id': image['carousel_id'],
         'image_id': image_id,
         'edit_prompt': prompt,
+        'prompt_hash': edit_prompt_hash(image_id, prompt),
         'nanabana_result_url': result_url,
         'status': 'completed',
         'completed_at': datetime.now().isoformat(),
@@ -188,14 +275,14 @@ def carousel_detail(carousel_id):
     """Carousel detail page - Show all images"""
 
     # Get carousel
-    carousel_result = supabase.table('instagram_carousels').select('*').eq('id', carousel_id).execute()
+    carousel_result = supabase.table('instagram_carousels').select('id,username,caption,likes_count,comments_count').eq('id', carousel_id).execute()
     if not carousel_result.data:
         return "Carousel not found", 404
 
     carousel = carousel_result.data[0]
 
     # Get all images for this carousel
-    images_result = supabase.table('carousel_images').select('*').eq('carousel_id', carousel_id).order('image_order').execute()
+    images_result = supabase.table('carousel_images').select('id,image_url,local_path,image_order').eq('carousel_id', carousel_id).order('image_order').execute()
     images = images_result.data
 
     return render_template('carousel_detail.html', carousel=carousel, images=images)
@@ -206,14 +293,14 @@ def test_edit(image_id):
     """Edit test page - Enter prompt and send to NanaBanana"""
 
     # Get image
-    image_result = supabase.table('carousel_images').select('*').eq('id', image_id).execute()
+    image_result = supabase.table('carousel_images').select('id,carousel_id,image_url,local_path').eq('id', image_id).execute()
     if not image_result.data:
         return "Image not found", 404
 
     image = image_result.data[0]
 
     # Get carousel
-    carousel_result = supabase.table('instagram_carousels').select('*').eq('id', image['carousel_id']).execute()
+    carousel_result = supabase.table('instagram_carousels').select('id').eq('id', image['carousel_id']).execute()
     carousel = carousel_result.data[0]
 
     return render_template('test_edit.html', image=image, carousel=carousel)
@@ -227,20 +314,44 @@ def submit_edit():
     image_id = data.get('image_id')
     carousel_id = data.get('carousel_id')
     edit_prompt = data.get('edit_prompt')
+    force = data.get('force', False)  # Skip the cache and always call NanaBanana
 
     # Get image URL
-    image_result = supabase.table('carousel_images').select('*').eq('id', image_id).execute()
+    image_result = supabase.table('carousel_images').select('id,carousel_id,image_url,local_path').eq('id', image_id).execute()
     if not image_result.data:
         return jsonify({'error': 'Image not found'}), 404
 
     image = image_result.data[0]
     image_url = image.get('local_path') or image['image_url']
 
+    # Same image + prompt already edited? Reuse the result instead of calling WaveSpeed again
+    prompt_hash = edit_prompt_hash(image_id, edit_prompt)
+    cached_url = None if force else find_cached_edit(prompt_hash)
+    if cached_url:
+        test_result = supabase.table('edit_tests').insert({
+            'carousel_id': carousel_id,
+            'image_id': image_id,
+            'edit_prompt': edit_prompt,
+            'prompt_hash': prompt_hash,
+            'nanabana_result_url': cached_url,
+            'status': 'completed',
+            'completed_at': datetime.now().isoformat()
+        }).execute()
+
+        return jsonify({
+            'success': True,
+            'test_id': test_result.data[0]['id'],
+            'result_url': cached_url,
+            'original_url': image_url,
+            'cached': True
+        })
+
     # Create edit test record
     edit_test_data = {
         'carousel_id': carousel_id,
         'image_id': image_id,
         'edit_prompt': edit_prompt,
+        'prompt_hash': prompt_hash,
         'status': 'processing'
     }
 
@@ -266,7 +377,7 @@ def submit_edit():
             "Content-Type": "application/json"
         }
 
-        response = requests.post(WAVESPEED_API_URL, json=payload, headers=headers, timeout=120)
+        response = SESSION.post(WAVESPEED_API_URL, json=payload, headers=headers, timeout=120)
         response.raise_for_status()
 
         result = response.json()
@@ -322,15 +433,15 @@ def review_edit(test_id):
     test = test_result.data[0]
 
     # Get image
-    image_result = supabase.table('carousel_images').select('*').eq('id', test['image_id']).execute()
+    image_result = supabase.table('carousel_images').select('id,image_url,local_path').eq('id', test['image_id']).execute()
     image = image_result.data[0]
 
     # Get carousel
-    carousel_result = supabase.table('instagram_carousels').select('*').eq('id', test['carousel_id']).execute()
+    carousel_result = supabase.table('instagram_carousels').select('id').eq('id', test['carousel_id']).execute()
     carousel = carousel_result.data[0]
 
     # Get other images in carousel (for batch processing preview)
-    other_images_result = supabase.table('carousel_images').select('*').eq('carousel_id', test['carousel_id']).neq('id', test['image_id']).order('image_order').execute()
+    other_images_result = supabase.table('carousel_images').select('id,image_url,local_path,image_order').eq('carousel_id', test['carousel_id']).neq('id', test['image_id']).order('image_order').execute()
     other_images = other_images_result.data
 
     return render_template('review.html', test=test, image=image, carousel=carousel, other_images=other_images)
@@ -338,34 +449,24 @@ def review_edit(test_id):
 
 @app.route('/api/approve_edit/<test_id>', methods=['POST'])
 def approve_edit(test_id):
-    """API endpoint - Approve edit and batch process remaining images with Workflow 4"""
+    """API endpoint - Approve edit and queue remaining images for ComfyUI batch processing"""
 
     data = request.json or {}
     notes = data.get('notes', '')
 
-    # RunPod/ComfyUI configuration
-    COMFYUI_API_URL = "https://9io0dgfk3xonew-8188.proxy.runpod.net"
-    RUNPOD_SSH_HOST = "203.57.40.245"
-    RUNPOD_SSH_PORT = "10120"
-    SSH_KEY_PATH = os.path.expanduser("~/.ssh/id_ed25519")
-
-    # Update edit test status
-    supabase.table('edit_tests').update({
+    # Update edit test status (PostgREST returns the updated row)
+    test_result = supabase.table('edit_tests').update({
         'status': 'approved',
         'approved_at': datetime.now().isoformat(),
         'notes': notes
     }).eq('id', test_id).execute()
+    if not test_result.data:
+        return jsonify({'success': False, 'error': 'Test not found'}), 404
 
-    # Get test details
-    test_result = supabase.table('edit_tests').select('*').eq('id', test_id).execute()
     test = test_result.data[0]
 
-    # Get approved edited image URL (this will be our model image)
-    model_image_url = test['nanabana_result_url']
-    original_prompt = test['edit_prompt']
-
     # Get other images from same carousel (these are pose references)
-    other_images = supabase.table('carousel_images').select('*').eq('carousel_id', test['carousel_id']).neq('id', test['image_id']).order('image_order').execute()
+    other_images = supabase.table('carousel_images').select('id,image_url,local_path,image_order').eq('carousel_id', test['carousel_id']).neq('id', test['image_id']).order('image_order').execute()
 
     if not other_images.data:
         return jsonify({
@@ -373,84 +474,117 @@ def approve_edit(test_id):
             'message': 'Edit approved! No other images to process.'
         })
 
-    # Create batch job record
+    # Pose list shared by the batch record and the background job
+    poses = [{'id': img['id'], 'url': img.get('local_path') or img['image_url'], 'order': img['image_order']} for img in other_images.data]
+
+    # Create batch job record - stays 'queued' until the workflows are submitted
     batch_data = {
         'edit_test_id': test_id,
         'carousel_id': test['carousel_id'],
-        'status': 'processing',
-        'images_to_process': [{'id': img['id'], 'url': img.get('local_path') or img['image_url'], 'order': img['image_order']} for img in other_images.data],
-        'workflow_name': 'OpenPose Workflow 2 (Batch)'
+        'status': 'queued',
+        'images_to_process': poses,
+        'workflow_name': 'OpenPose Workflow 2 (Batch)',
+        'created_at': datetime.now().isoformat()  # Same clock as started_at for QUEUED_BATCH_TIMEOUT
     }
 
     batch_result = supabase.table('comfyui_batches').insert(batch_data).execute()
     batch_id = batch_result.data[0]['id']
 
-    try:
-        # 1. Download model image (NanaBanana edited image) to RunPod
-        print(f"📥 Downloading model image to RunPod...")
+    # Uploads + workflow submission run in the background - don't block the request
+    BATCH_EXECUTOR.submit(process_batch, batch_id, test, poses)
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_model:
-            model_response = requests.get(model_image_url, timeout=30)
-            model_response.raise_for_status()
-            tmp_model.write(model_response.content)
-            tmp_model_path = tmp_model.name
+    return jsonify({
+        'success': True,
+        'message': f'Edit approved! Batch queued for {len(poses)} poses. Check /batches to monitor progress.',
+        'batch_id': batch_id,
+        'status': 'queued'
+    }), 202
 
-        model_filename = f"model_{uuid.uuid4().hex[:8]}.jpg"
 
-        subprocess.run([
-            'scp', '-P', RUNPOD_SSH_PORT, '-i', SSH_KEY_PATH,
-            tmp_model_path,
-            f'root@{RUNPOD_SSH_HOST}:/workspace/ComfyUI/input/{model_filename}'
-        ], check=True, timeout=30)
+def process_batch(batch_id, test, poses):
+    """Upload model + pose images to RunPod and trigger Workflow 2 for each pose
 
-        os.unlink(tmp_model_path)
-        print(f"✅ Model image uploaded as {model_filename}")
+    Runs on BATCH_EXECUTOR; poll_batch picks the batch up once it is 'processing'.
+    """
+
+    # Get approved edited image URL (this will be our model image)
+    model_image_url = test['nanabana_result_url']
+
+    try:
+        supabase.table('comfyui_batches').update({
+            'started_at': datetime.now().isoformat()
+        }).eq('id', batch_id).execute()
 
-        # 2. Create pose images folder on RunPod
+        model_filename = f"model_{uuid.uuid4().hex[:8]}.jpg"
         pose_folder = f"pose_{uuid.uuid4().hex[:8]}"
-        subprocess.run([
-            'ssh', '-p', RUNPOD_SSH_PORT, '-i', SSH_KEY_PATH,
-            f'root@{RUNPOD_SSH_HOST}',
-            f'mkdir -p /workspace/ComfyUI/input/{pose_folder}'
-        ], check=True, timeout=10)
 
-        # 3. Download all pose reference images to RunPod
-        print(f"📥 Downloading {len(other_images.data)} pose images to RunPod...")
+        def upload_model_image():
+            # 1. Download model image (NanaBanana edited image) to RunPod
+            print(f"📥 Downloading model image to RunPod...")
+
+            model_content = download_streamed(model_image_url, timeout=30)
+
+            # Pipe the bytes straight into ssh - no temp file on disk
+            subprocess.run([
+                'ssh', '-p', RUNPOD_SSH_PORT, '-i', SSH_KEY_PATH,
+                f'root@{RUNPOD_SSH_HOST}',
+                f'cat > /workspace/ComfyUI/input/{model_filename}'
+            ], input=model_content, check=True, timeout=30)
+
+            print(f"✅ Model image uploaded as {model_filename}")
 
-        for idx, img_data in enumerate(other_images.data):
-            img_url = img_data.get('local_path') or img_data['image_url']
+        def fetch_pose(pose):
+            return download_streamed(pose['url'], timeout=30)
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_pose:
-                pose_response = requests.get(img_url, timeout=30)
-                pose_response.raise_for_status()
-                tmp_pose.write(pose_response.content)
-                tmp_pose_path = tmp_pose.name
+        def upload_pose_images():
+            # 2. Download all pose reference images into memory
+            print(f"📥 Downloading {len(poses)} pose images...")
 
-            pose_filename = f"pose{idx + 1}.jpg"
+            # Download poses in parallel (pure I/O wait)
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                pose_contents = list(executor.map(fetch_pose, poses))
+
+            # 3. Upload the whole pose folder to RunPod as an in-memory tar over a single SSH connection
+            tar_buffer = io.BytesIO()
+            with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
+                for idx, content in enumerate(pose_contents):
+                    info = tarfile.TarInfo(name=f"pose{idx + 1}.jpg")
+                    info.size = len(content)
+                    tar.addfile(info, io.BytesIO(content))
 
             subprocess.run([
-                'scp', '-P', RUNPOD_SSH_PORT, '-i', SSH_KEY_PATH,
-                tmp_pose_path,
-                f'root@{RUNPOD_SSH_HOST}:/workspace/ComfyUI/input/{pose_folder}/{pose_filename}'
-            ], check=True, timeout=30)
+                'ssh', '-p', RUNPOD_SSH_PORT, '-i', SSH_KEY_PATH,
+                f'root@{RUNPOD_SSH_HOST}',
+                f'mkdir -p /workspace/ComfyUI/input/{pose_folder} && tar xf - -C /workspace/ComfyUI/input/{pose_folder}'
+            ], input=tar_buffer.getvalue(), check=True, timeout=60)
 
-            os.unlink(tmp_pose_path)
+            print(f"✅ All pose images uploaded to {pose_folder}")
 
-        print(f"✅ All pose images uploaded to {pose_folder}")
+        # Model and pose uploads are independent - overlap their network waits
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            uploads = [executor.submit(upload_model_image), executor.submit(upload_pose_images)]
+            for upload in uploads:
+                upload.result()
 
-        # 4. Load Workflow 2 template (has OpenPose preprocessing)
-        workflow_path = '/workspaces/business/OpenPose Workflow 2 - Jockerai (2).json'
-        with open(workflow_path, 'r') as f:
-            workflow_template = json.load(f)
+        # 4. Workflow 2 template (has OpenPose preprocessing), loaded at startup
+        workflow_template = WORKFLOW_TEMPLATE
+        if workflow_template is None:
+            raise Exception(f"Workflow template not found: {WORKFLOW_PATH}")
 
         # 5. Trigger Workflow 2 for each pose image (hybrid approach)
-        print(f"🚀 Triggering Workflow 2 for {len(other_images.data)} poses...")
+        print(f"🚀 Triggering Workflow 2 for {len(poses)} poses...")
 
         import random
-        prompt_ids = []
+        jobs = []
+
+        # Only these nodes get per-pose inputs; the rest are shared with the template
+        per_pose_nodes = {"67", "78", "179", "74", "94"}
 
-        for pose_index, pose_img in enumerate(other_images.data):
-            workflow = json.loads(json.dumps(workflow_template))  # Deep copy
+        for pose_index, pose_img in enumerate(poses):
+            workflow = {
+                node_id: (dict(node, inputs=dict(node['inputs'])) if node_id in per_pose_nodes else node)
+                for node_id, node in workflow_template.items()
+            }
 
             # Configure workflow for this specific pose
             workflow["67"]["inputs"]["unet_name"] = "qwen_image_edit_2509_fp8_e4m3fn.safetensors"
@@ -459,17 +593,22 @@ def approve_edit(test_id):
             workflow["74"]["inputs"]["seed"] = random.randint(1000000000000, 9999999999999)
             workflow["94"]["inputs"]["filename_prefix"] = f"{batch_id}_pose{pose_index + 1}"
 
-            # Trigger workflow
-            payload = {"prompt": workflow}
-            response = requests.post(f"{COMFYUI_API_URL}/prompt", json=payload, timeout=30)
+            jobs.append((pose_index, workflow))
+
+        def submit(job):
+            pose_index, workflow = job
+
+            # Trigger workflow - ComfyUI queues it and returns immediately
+            response = SESSION.post(f"{COMFYUI_API_URL}/prompt", json={"prompt": workflow}, timeout=30)
             response.raise_for_status()
 
             result = response.json()
             if 'prompt_id' in result:
-                prompt_ids.append(result['prompt_id'])
-                print(f"  ✅ Pose {pose_index + 1}/{len(other_images.data)}: {result['prompt_id']}")
+                print(f"  ✅ Pose {pose_index + 1}/{len(jobs)}: {result['prompt_id']}")
+            return result.get('prompt_id')
 
-            time.sleep(1)  # Small delay between requests
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            prompt_ids = [prompt_id for prompt_id in executor.map(submit, jobs) if prompt_id]
 
         print(f"✅ All workflows triggered! Prompt IDs: {prompt_ids}")
 
@@ -479,15 +618,6 @@ def approve_edit(test_id):
             'comfyui_prompt_ids': prompt_ids
         }).eq('id', batch_id).execute()
 
-        # Return immediately - don't block the request
-        return jsonify({
-            'success': True,
-            'message': f'Edit approved! Workflows triggered for {len(other_images.data)} poses. Check /batches to monitor progress.',
-            'batch_id': batch_id,
-            'prompt_ids': prompt_ids
-        })
-
-
     except Exception as e:
         print(f"❌ Batch processing error: {e}")
         import traceback
@@ -500,11 +630,6 @@ def approve_edit(test_id):
             'completed_at': datetime.now().isoformat()
         }).eq('id', batch_id).execute()
 
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
 
 @app.route('/api/reject_edit/<test_id>', methods=['POST'])
 def reject_edit(test_id):
@@ -528,12 +653,22 @@ def reject_edit(test_id):
 def poll_batch(batch_id):
     """Poll a batch for completion and download results"""
 
-    COMFYUI_API_URL = "https://9io0dgfk3xonew-8188.proxy.runpod.net"
-
     # Get batch
     result = supabase.table('comfyui_batches').select('*').eq('id', batch_id).single().execute()
     batch = result.data
 
+    if batch and batch['status'] == 'queued':
+        # Job never started (or died mid-upload) - fail it instead of polling forever
+        queued_since = datetime.fromisoformat(batch.get('started_at') or batch['created_at'])
+        if datetime.now() - queued_since > QUEUED_BATCH_TIMEOUT:
+            failed = supabase.table('comfyui_batches').update({
+                'status': 'failed',
+                'error_message': 'Background job was lost before submitting to ComfyUI (app restarted?)',
+                'completed_at': datetime.now().isoformat()
+            }).eq('id', batch_id).eq('status', 'queued').execute()
+            if failed.data:
+                batch = failed.data[0]
+
     if not batch or batch['status'] != 'processing':
         return jsonify(batch)
 
@@ -546,55 +681,63 @@ def poll_batch(batch_id):
         }).eq('id', batch_id).execute()
         return jsonify({'status': 'completed', 'message': 'Old batch marked complete'})
 
-    # Check if all workflows are complete
-    completed_images = []
+    def fetch_history(prompt_id):
+        response = SESSION.get(f"{COMFYUI_API_URL}/history/{prompt_id}", timeout=10)
+        response.raise_for_status()
+        return response.json()
 
-    for idx, prompt_id in enumerate(prompt_ids):
-        try:
-            # Check history via HTTPS API
-            history_url = f"{COMFYUI_API_URL}/history/{prompt_id}"
-            response = requests.get(history_url, timeout=10)
-            response.raise_for_status()
-            history_data = response.json()
+    # Check all workflows concurrently via HTTPS API
+    try:
+        with ThreadPoolExecutor(max_workers=min(len(prompt_ids), 16)) as executor:
+            histories = list(executor.map(fetch_history, prompt_ids))
+    except Exception as e:
+        print(f"Error polling batch {batch_id}: {e}")
+        return jsonify({'status': 'processing', 'message': 'Error checking poses'})
 
-            # Check if completed
-            if prompt_id not in history_data:
-                return jsonify({'status': 'processing', 'message': f'Waiting for pose {idx + 1}...'})
+    for idx, (prompt_id, history_data) in enumerate(zip(prompt_ids, histories)):
+        if prompt_id not in history_data:
+            return jsonify({'status': 'processing', 'message': f'Waiting for pose {idx + 1}...'})
 
-            if not history_data[prompt_id].get('status', {}).get('completed'):
-                return jsonify({'status': 'processing', 'message': f'Pose {idx + 1} still generating...'})
+        if not history_data[prompt_id].get('status', {}).get('completed'):
+            return jsonify({'status': 'processing', 'message': f'Pose {idx + 1} still generating...'})
 
+    # All workflows complete - download results and upload to Supabase in parallel
+    def fetch_upload(idx):
+        try:
             # Download the result
             actual_filename = f"{batch_id}_pose{idx + 1}_00001_.png"
             download_url = f"{COMFYUI_API_URL}/api/view?filename={actual_filename}&type=output&subfolder="
 
-            download_response = requests.get(download_url, timeout=60)
-            download_response.raise_for_status()
-
-            file_data = download_response.content
+            file_data = download_streamed(download_url, timeout=60)
 
             # Upload to Supabase Storage (upsert=True to overwrite if exists)
             storage_path = f"pose_transfers/{batch_id}_pose{idx + 1}.png"
 
             # Try to delete first if exists, then upload
             try:
-                supabase.storage.from_('carousel-images').remove([storage_path])
+                image_bucket.remove([storage_path])
             except:
                 pass  # File doesn't exist, that's fine
 
-            supabase.storage.from_('carousel-images').upload(
+            image_bucket.upload(
                 storage_path,
                 file_data,
                 file_options={"content-type": "image/png", "upsert": "true"}
             )
 
             # Get public URL
-            public_url = supabase.storage.from_('carousel-images').get_public_url(storage_path)
-            completed_images.append(public_url)
+            return image_bucket.get_public_url(storage_path)
 
         except Exception as e:
             print(f"Error polling pose {idx + 1}: {e}")
-            return jsonify({'status': 'processing', 'message': f'Error checking pose {idx + 1}'})
+            return None
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        completed_images = list(executor.map(fetch_upload, range(len(prompt_ids))))
+
+    if None in completed_images:
+        failed_idx = completed_images.index(None)
+        return jsonify({'status': 'processing', 'message': f'Error checking pose {failed_idx + 1}'})
 
     # All complete! Update batch
     supabase.table('comfyui_batches').update({
@@ -644,11 +787,11 @@ def api_pose_transfer():
     try:
         # Download images
         print(f"Downloading model image: {model_image_url}")
-        model_response = requests.get(model_image_url, timeout=30)
+        model_response = SESSION.get(model_image_url, timeout=30)
         model_response.raise_for_status()
 
         print(f"Downloading pose image: {pose_image_url}")
-        pose_response = requests.get(pose_image_url, timeout=30)
+        pose_response = SESSION.get(pose_image_url, timeout=30)
         pose_response.raise_for_status()
 
         # Generate unique filenames
@@ -687,7 +830,7 @@ def api_pose_transfer():
         os.unlink(tmp_model_path)
         os.unlink(tmp_pose_path)
 
-        # Trigger ComfyUI workflow via SSH
+        # Trigger ComfyUI workflow
         workflow_payload = {
             "prompt": {
                 "67": {"inputs": {"unet_name": "qwen_image_edit_2509_fp8_e4m3fn.safetensors", "weight_dtype": "fp8_e4m3fn"}, "class_type": "UNETLoader"},
@@ -711,39 +854,32 @@ def api_pose_transfer():
             }
         }
 
-        # Call ComfyUI API via SSH tunnel
-        import json
-        curl_cmd = f"curl -X POST http://127.0.0.1:8188/prompt -H 'Content-Type: application/json' -d '{json.dumps(workflow_payload)}'"
-
-        result = subprocess.run([
-            'ssh', '-p', RUNPOD_PORT, '-i', os.path.expanduser('~/.ssh/id_ed25519'),
-            f'root@{RUNPOD_HOST}', curl_cmd
-        ], capture_output=True, text=True, check=True)
+        # Call ComfyUI API directly over the proxied HTTPS endpoint
+        response = SESSION.post(f"{COMFYUI_API_URL}/prompt", json=workflow_payload, timeout=30)
+        response.raise_for_status()
 
-        api_response = json.loads(result.stdout.split('\n')[-1])
+        api_response = response.json()
         prompt_id = api_response.get('prompt_id')
 
         print(f"✅ Workflow triggered! Prompt ID: {prompt_id}")
         print(f"⏳ Waiting for generation to complete...")
 
-        # Poll for completion (max 2 minutes)
+        # Poll for completion (max 2 minutes), backing off from 1s up to 3s between checks
         import time
-        max_attempts = 40  # 40 * 3 seconds = 2 minutes
+        deadline = time.time() + 120
+        delay = 1
         attempt = 0
         output_filename = None
 
-        while attempt < max_attempts:
-            time.sleep(3)
+        while time.time() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 3)
             attempt += 1
 
-            # Check history via SSH
-            history_cmd = f"curl -s http://127.0.0.1:8188/history/{prompt_id}"
-            history_result = subprocess.run([
-                'ssh', '-p', RUNPOD_PORT, '-i', os.path.expanduser('~/.ssh/id_ed25519'),
-                f'root@{RUNPOD_HOST}', history_cmd
-            ], capture_output=True, text=True, timeout=10)
-
-            history_data = json.loads(history_result.stdout)
+            # Check history via HTTPS API
+            history_response = SESSION.get(f"{COMFYUI_API_URL}/history/{prompt_id}", timeout=10)
+            history_response.raise_for_status()
+            history_data = history_response.json()
 
             # Check if completed
             if prompt_id in history_data and history_data[prompt_id].get('status', {}).get('completed'):
@@ -755,7 +891,7 @@ def api_pose_transfer():
                         break
                 break
 
-            print(f"  Attempt {attempt}/{max_attempts}...")
+            print(f"  Attempt {attempt}...")
 
         if not output_filename:
             return jsonify({
@@ -767,33 +903,22 @@ def api_pose_transfer():
 
         print(f"✅ Generation complete! Output: {output_filename}")
 
-        # Download result image from RunPod
-        output_path = f"/workspace/ComfyUI/output/{output_filename}"
-        local_result_path = f"/tmp/result_{job_id}.png"
+        # Download result image from ComfyUI (streamed, no local temp file)
+        download_url = f"{COMFYUI_API_URL}/api/view?filename={output_filename}&type=output&subfolder="
+        file_data = download_streamed(download_url, timeout=60)
 
-        subprocess.run([
-            'scp', '-P', RUNPOD_PORT, '-i', os.path.expanduser('~/.ssh/id_ed25519'),
-            f'root@{RUNPOD_HOST}:{output_path}', local_result_path
-        ], check=True)
-
-        print(f"✅ Downloaded result to {local_result_path}")
+        print(f"✅ Downloaded result {output_filename}")
 
         # Upload to Supabase storage
-        with open(local_result_path, 'rb') as f:
-            file_data = f.read()
-
         storage_path = f"pose_transfers/{job_id}_{output_filename}"
-        supabase.storage.from_('carousel-images').upload(
+        image_bucket.upload(
             storage_path,
             file_data,
             file_options={"content-type": "image/png"}
         )
 
         # Get public URL
-        result_url = supabase.storage.from_('carousel-images').get_public_url(storage_path)
-
-        # Clean up
-        os.unlink(local_result_path)
+        result_url = image_bucket.get_public_url(storage_path)
 
         print(f"✅ Uploaded to Supabase: {result_url}")
 
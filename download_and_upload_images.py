@@ -3,21 +3,111 @@
 Download Instagram images and upload them to Supabase Storage
 Updates the database with new Supabase Storage URLs
 """
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+import httpx
 import os
+import queue
 import requests
-from io import BytesIO
+import tempfile
+import threading
 import time
 
 load_dotenv('.env.local')
 
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Threads making blocking Supabase SDK calls (Storage uploads + DB updates)
+SUPABASE_WORKERS = 8
+SUPABASE_POOL = ThreadPoolExecutor(max_workers=SUPABASE_WORKERS, thread_name_prefix='sb')
+
+# Supabase HTTP pool sized to the SDK threads so every in-flight call has a kept-alive connection
+supabase_http = httpx.Client(
+    transport=httpx.HTTPTransport(
+        limits=httpx.Limits(max_keepalive_connections=SUPABASE_WORKERS, max_connections=SUPABASE_WORKERS),
+        retries=3
+    ),
+    timeout=120
+)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=supabase_http))
 
 STORAGE_BUCKET = 'carousel-images'
 
+# Storage API handle for the bucket - built once instead of per call
+bucket = supabase.storage.from_(STORAGE_BUCKET)
+
+# Download workers (uploads run on SUPABASE_POOL so the two overlap),
+# plus the overall Instagram download rate the downloaders share
+DOWNLOAD_WORKERS = 16
+DOWNLOADS_PER_SECOND = 8
+
+# Images downloaded or downloading but not yet uploaded - bounds temp files on disk
+MAX_PENDING_UPLOADS = 64
+
+# Rows per carousel_images upsert
+DB_BATCH_SIZE = 100
+
+# Download chunk size when streaming images to disk
+CHUNK_SIZE = 64 * 1024
+
+# Storage content-type per file extension we know how to serve
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+
+# Shared HTTP session - reuses TCP/TLS connections to the Instagram CDN across workers,
+# and retries rate-limit/5xx responses with backoff (honouring Retry-After)
+session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=DOWNLOAD_WORKERS,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True
+    )
+)
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+
+
+class RateLimiter:
+    """Token bucket shared by worker threads - only waits when we actually hit the rate"""
+
+    def __init__(self, rate, per=1.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) * self.per / self.rate
+
+            time.sleep(wait)
+
+
+download_limiter = RateLimiter(DOWNLOADS_PER_SECOND)
+
 def create_storage_bucket():
     """Create storage bucket if it doesn't exist"""
     try:
@@ -36,6 +126,88 @@ def create_storage_bucket():
         else:
             print(f"⚠️  Bucket creation note: {e}")
 
+def sniff_extension(head):
+    """Pick an image extension from the first bytes of the file"""
+    if head.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return 'jpg'
+
+def download_image(image):
+    """Stream one Instagram image to a temp file, returns (tmp_path, ext)"""
+
+    image_url = image['image_url']
+
+    # Get file extension from the URL path (ignores signed query params), sniffed from the bytes if unknown
+    ext = os.path.splitext(urlsplit(image_url).path)[1][1:].lower()
+
+    # Stream to a temp file so only one chunk per worker sits in memory
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        tmp_path = tmp.name
+
+    try:
+        download_limiter.acquire()
+        with session.get(image_url, stream=True, timeout=30) as response, open(tmp_path, 'wb') as out:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if ext not in CONTENT_TYPES:
+                    ext = sniff_extension(chunk)
+                out.write(chunk)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    if ext not in CONTENT_TYPES:
+        ext = 'jpg'
+
+    return tmp_path, ext
+
+def upload_image(image, tmp_path, ext):
+    """Upload a downloaded image to Supabase Storage and remove the temp file"""
+
+    # Create filename
+    filename = f"{image['carousel_id']}/{image['image_order']}.{ext}"
+
+    try:
+        # Upload to Supabase Storage (file handle is streamed by the client)
+        with open(tmp_path, 'rb') as f:
+            bucket.upload(
+                filename,
+                f,
+                file_options={
+                    'content-type': CONTENT_TYPES[ext],
+                    'upsert': 'true'
+                }
+            )
+    finally:
+        os.unlink(tmp_path)
+
+    # Get public URL (database is updated in batches by the caller)
+    public_url = bucket.get_public_url(filename)
+
+    return filename, public_url
+
+def flush_updates(pending_updates):
+    """Write a batch of new local_path values in one upsert, falling back to per-row updates"""
+
+    if not pending_updates:
+        return
+
+    try:
+        supabase.table('carousel_images').upsert(pending_updates, on_conflict='id').execute()
+    except Exception as e:
+        print(f"  ⚠️  Batch update of {len(pending_updates)} rows failed ({e}), retrying row by row...")
+        for row in pending_updates:
+            try:
+                supabase.table('carousel_images').update({
+                    'local_path': row['local_path']
+                }).eq('id', row['id']).execute()
+            except Exception as row_error:
+                print(f"  ❌ DB update failed for {row['id'][:8]}: {row_error}")
+
 def download_and_upload_images():
     """Download Instagram images and upload to Supabase Storage"""
 
@@ -46,71 +218,73 @@ def download_and_upload_images():
     print()
 
     # Get all images that don't have local_path set
-    result = supabase.table('carousel_images').select('*').is_('local_path', 'null').execute()
+    result = supabase.table('carousel_images').select('id,image_url,carousel_id,image_order').is_('local_path', 'null').execute()
     images = result.data
 
-    print(f"📸 Found {len(images)} images to process\n")
+    print(f"📸 Found {len(images)} images to process ({DOWNLOAD_WORKERS} downloaders, {SUPABASE_WORKERS} Supabase workers)\n")
 
     success_count = 0
     error_count = 0
+    pending_updates = []
+    db_writes = []
 
-    for i, image in enumerate(images, 1):
-        image_id = image['id']
-        image_url = image['image_url']
-        carousel_id = image['carousel_id']
-        image_order = image['image_order']
-
-        print(f"[{i}/{len(images)}] Processing image {image_id[:8]}...")
+    # Pipeline: downloaders -> SUPABASE_POOL uploads -> results -> batched DB updates (also on SUPABASE_POOL)
+    upload_slots = threading.BoundedSemaphore(MAX_PENDING_UPLOADS)
+    results = queue.Queue()
 
+    def upload_task(image, tmp_path, ext):
         try:
-            # Download image from Instagram
-            print(f"  ⬇️  Downloading from Instagram...")
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
+            results.put((image, upload_image(image, tmp_path, ext), None))
+        except Exception as e:
+            results.put((image, None, e))
+        finally:
+            upload_slots.release()
 
-            # Get file extension from URL or default to jpg
-            if '.jpg' in image_url:
-                ext = 'jpg'
-            elif '.png' in image_url:
-                ext = 'png'
-            else:
-                ext = 'jpg'
+    def download_worker(image):
+        upload_slots.acquire()
+        try:
+            tmp_path, ext = download_image(image)
+        except Exception as e:
+            upload_slots.release()
+            results.put((image, None, e))
+            return
+        SUPABASE_POOL.submit(upload_task, image, tmp_path, ext)
 
-            # Create filename
-            filename = f"{carousel_id}/{image_order}.{ext}"
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='download') as executor:
+        for image in images:
+            executor.submit(download_worker, image)
 
-            # Upload to Supabase Storage
-            print(f"  ⬆️  Uploading to Supabase Storage...")
-            supabase.storage.from_(STORAGE_BUCKET).upload(
-                filename,
-                response.content,
-                file_options={
-                    'content-type': f'image/{ext}',
-                    'upsert': 'true'
-                }
-            )
-
-            # Get public URL
-            public_url = supabase.storage.from_(STORAGE_BUCKET).get_public_url(filename)
+        # Every image ends up on results exactly once, either stored or failed
+        for i in range(1, len(images) + 1):
+            image, stored, error = results.get()
+            image_id = image['id']
 
-            # Update database with new URL
-            supabase.table('carousel_images').update({
-                'local_path': public_url
-            }).eq('id', image_id).execute()
+            if error:
+                print(f"[{i}/{len(images)}] ❌ {image_id[:8]} error: {error}")
+                error_count += 1
+                continue
 
-            print(f"  ✅ Success! Stored at: {filename}")
+            filename, public_url = stored
+            print(f"[{i}/{len(images)}] ✅ {image_id[:8]} stored at: {filename}")
             success_count += 1
 
-            # Small delay to avoid rate limiting
-            time.sleep(0.5)
-
-        except Exception as e:
-            print(f"  ❌ Error: {e}")
-            error_count += 1
+            # Full row so the upsert never trips NOT NULL columns
+            pending_updates.append({
+                'id': image_id,
+                'carousel_id': image['carousel_id'],
+                'image_url': image['image_url'],
+                'image_order': image['image_order'],
+                'local_path': public_url
+            })
+            if len(pending_updates) >= DB_BATCH_SIZE:
+                db_writes.append(SUPABASE_POOL.submit(flush_updates, pending_updates))
+                pending_updates = []
 
-        print()
+    db_writes.append(SUPABASE_POOL.submit(flush_updates, pending_updates))
+    for write in db_writes:
+        write.result()
 
-    print(f"{'='*60}")
+    print(f"\n{'='*60}")
     print(f"✅ Upload complete!")
     print(f"  - Success: {success_count}")
     print(f"  - Errors: {error_count}")
@@ -4,7 +4,10 @@ Fetch Instagram profile data using Apify Instagram Scraper API
 """
 import os
 import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -13,6 +16,23 @@ load_dotenv('.env.local')
 APIFY_API_TOKEN = os.getenv('APIFY_API_TOKEN')
 APIFY_API_URL = os.getenv('APIFY_API_URL')
 
+# Keep-alive session - reuses TCP/TLS connections across requests and retries
+# connect errors and rate limits with backoff. Each POST starts a billed scraper run,
+# so read timeouts and 5xx (the run may already be going) are never re-POSTed
+session = requests.Session()
+session.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=5,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=[429],
+        allowed_methods=['GET', 'POST'],
+        respect_retry_after_header=True
+    )
+))
+
 def fetch_instagram_profile(username):
     """
     Fetch Instagram profile data using Apify API
@@ -71,11 +91,11 @@ def fetch_instagram_profile(username):
 
     try:
         # Make API request (long timeout for comprehensive scraping)
-        response = requests.post(url, json=payload, headers=headers, timeout=600)
+        response = session.post(url, data=orjson.dumps(payload), headers=headers, timeout=600)
         response.raise_for_status()
 
         # Parse response
-        data = response.json()
+        data = orjson.loads(response.content)
 
         # FILTER: Only keep posts OWNED by target user (not tagged/co-authored)
         if isinstance(data, list):
@@ -87,8 +107,8 @@ def fetch_instagram_profile(username):
 
         # Save results
         output_file = f"instagram_{username}_data.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
         print(f"\n✅ Success! Data saved to: {output_file}")
         print(f"📊 Total items fetched: {len(data) if isinstance(data, list) else 1}")
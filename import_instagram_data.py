@@ -3,36 +3,255 @@
 Import Instagram JSON data into Supabase database
 Reads instagram_ivyirelandx_data.json and populates the tables
 """
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import ciso8601
+import gzip
+import httpx
 import os
-import json
+import orjson
+import uuid
 
 load_dotenv('.env.local')
 
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 
+# Direct Postgres connection (same one setup_database.py uses) - enables COPY for bulk loads
+DIRECT_URL = os.getenv('DIRECT_URL')
+
+# Carousels per bulk insert request
+INSERT_BATCH_SIZE = 50
+
+# Storage bucket for the full scraper payload of each post - rows only keep its URL
+RAW_JSON_BUCKET = 'raw-json'
+RAW_UPLOAD_WORKERS = 8
+
+# Opt-in (POSTGREST_GZIP=1): send PostgREST request bodies larger than GZIP_MIN_BYTES gzip-compressed
+POSTGREST_GZIP = os.getenv('POSTGREST_GZIP') == '1'
+GZIP_MIN_BYTES = 1024
+
+
+class GzipTransport(httpx.HTTPTransport):
+    """Gzip large PostgREST request bodies - bulk inserts send hundreds of rows at once
+
+    If the server rejects a compressed body (400/415) it is resent uncompressed
+    and gzip stays off for the rest of the run, so no chunk is lost to it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enabled = True
+
+    def handle_request(self, request):
+        if not self.enabled or '/rest/v1/' not in request.url.path or 'Content-Encoding' in request.headers:
+            return super().handle_request(request)
+
+        body = request.read()
+        if len(body) <= GZIP_MIN_BYTES:
+            return super().handle_request(request)
+
+        headers = httpx.Headers(request.headers)
+        headers['Content-Encoding'] = 'gzip'
+        del headers['Content-Length']
+        compressed = httpx.Request(
+            request.method,
+            request.url,
+            headers=headers,
+            content=gzip.compress(body),
+            extensions=request.extensions
+        )
+
+        response = super().handle_request(compressed)
+        if response.status_code not in (400, 415):
+            return response
+
+        response.read()
+        response.close()
+        print(f"  ⚠️  Server rejected a gzip body ({response.status_code}), sending uncompressed from now on")
+        self.enabled = False
+        return super().handle_request(request)
+
+
+def copy_rows(carousel_rows, image_rows, store_raw):
+    """Bulk load rows with COPY over a direct Postgres connection (all or nothing)
+
+    Rows are copied into temp staging tables and moved over with ON CONFLICT DO NOTHING,
+    so carousels that are already imported are skipped atomically by Postgres.
+    Raw payloads are stored (store_raw) only for the carousels actually inserted.
+    Returns (imported_count, failed_count) - any error fails every row.
+    """
+
+    # Only needed for the COPY path - the PostgREST fallback runs without psycopg installed
+    import psycopg
+
+    try:
+        with psycopg.connect(DIRECT_URL) as conn, conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE staging_carousels (LIKE instagram_carousels INCLUDING DEFAULTS) ON COMMIT DROP")
+            cur.execute("CREATE TEMP TABLE staging_images (LIKE carousel_images INCLUDING DEFAULTS) ON COMMIT DROP")
+
+            with cur.copy("COPY staging_carousels (id, post_id, username, caption, likes_count, comments_count, posted_at, image_count) FROM STDIN") as copy:
+                for row in carousel_rows:
+                    copy.write_row((
+                        row['id'], row['post_id'], row['username'], row['caption'],
+                        row['likes_count'], row['comments_count'], row['posted_at'],
+                        row['image_count']
+                    ))
+
+            with cur.copy("COPY staging_images (carousel_id, image_url, image_order, width, height) FROM STDIN") as copy:
+                for row in image_rows:
+                    copy.write_row((
+                        row['carousel_id'], row['image_url'], row['image_order'],
+                        row['width'], row['height']
+                    ))
+
+            cur.execute("""
+                INSERT INTO instagram_carousels (id, post_id, username, caption, likes_count, comments_count, posted_at, image_count)
+                SELECT id, post_id, username, caption, likes_count, comments_count, posted_at, image_count
+                FROM staging_carousels
+                ON CONFLICT (post_id) DO NOTHING
+                RETURNING id, post_id
+            """)
+            inserted = cur.fetchall()
+
+            # Carousels whose payload didn't make it to Storage are left out of this run
+            # (a later import retries them) instead of being kept without raw data
+            raw_urls = store_raw([post_id for _, post_id in inserted])
+            stored = [(carousel_id, raw_urls[post_id]) for carousel_id, post_id in inserted if post_id in raw_urls]
+            failed_ids = [carousel_id for carousel_id, post_id in inserted if post_id not in raw_urls]
+
+            if failed_ids:
+                cur.execute("DELETE FROM instagram_carousels WHERE id = ANY(%s)", (failed_ids,))
+            if stored:
+                cur.execute("""
+                    UPDATE instagram_carousels c
+                    SET raw_data_url = u.raw_data_url
+                    FROM unnest(%s::uuid[], %s::text[]) AS u(id, raw_data_url)
+                    WHERE c.id = u.id
+                """, ([carousel_id for carousel_id, _ in stored], [url for _, url in stored]))
+
+            # Only images whose carousel was actually inserted above
+            cur.execute("""
+                INSERT INTO carousel_images (carousel_id, image_url, image_order, width, height)
+                SELECT s.carousel_id, s.image_url, s.image_order, s.width, s.height
+                FROM staging_images s
+                WHERE EXISTS (SELECT 1 FROM instagram_carousels c WHERE c.id = s.carousel_id)
+                ON CONFLICT (carousel_id, image_order) DO NOTHING
+            """)
+            images_count = cur.rowcount
+
+        print(f"  ✓ Copied {len(stored)} carousels with {images_count} images")
+        return len(stored), len(failed_ids)
+
+    except Exception as e:
+        print(f"  ❌ Error copying rows, nothing was imported: {e}")
+        return 0, len(carousel_rows)
+
+def insert_rows(supabase, carousel_rows, image_rows, store_raw):
+    """Bulk insert rows through PostgREST, INSERT_BATCH_SIZE carousels per request
+
+    Raw payloads are stored (store_raw) only for the carousels actually inserted.
+    Returns (imported_count, failed_count).
+    """
+
+    images_by_carousel_id = {}
+    for row in image_rows:
+        images_by_carousel_id.setdefault(row['carousel_id'], []).append(row)
+
+    imported_count = 0
+    failed_count = 0
+
+    # Insert carousels, then all of their images, one chunk at a time
+    for start in range(0, len(carousel_rows), INSERT_BATCH_SIZE):
+        chunk = carousel_rows[start:start + INSERT_BATCH_SIZE]
+
+        try:
+            # Already-imported post_ids are skipped by Postgres; only new rows come back
+            result = supabase.table('instagram_carousels').upsert(chunk, on_conflict='post_id', ignore_duplicates=True).execute()
+
+            # Carousels whose payload didn't make it to Storage are removed again so a later import retries them
+            raw_urls = store_raw([row['post_id'] for row in result.data])
+            failed_ids = [row['id'] for row in result.data if row['post_id'] not in raw_urls]
+            if failed_ids:
+                supabase.table('instagram_carousels').delete().in_('id', failed_ids).execute()
+
+            stored = [{**row, 'raw_data_url': raw_urls[row['post_id']]} for row in result.data if row['post_id'] in raw_urls]
+            if stored:
+                supabase.table('instagram_carousels').upsert(stored, on_conflict='id').execute()
+
+            chunk_images = [img for row in stored for img in images_by_carousel_id.get(row['id'], [])]
+            if chunk_images:
+                supabase.table('carousel_images').upsert(chunk_images, on_conflict='carousel_id,image_order', ignore_duplicates=True).execute()
+
+            print(f"  ✓ Inserted {len(stored)} carousels with {len(chunk_images)} images")
+            imported_count += len(stored)
+            failed_count += len(failed_ids)
+
+        except Exception as e:
+            print(f"  ❌ Error inserting carousels {start + 1}-{start + len(chunk)}: {e}")
+            failed_count += len(chunk)
+            continue
+
+    return imported_count, failed_count
+
+def upload_raw_json(raw_bucket, post):
+    """Upload one post's full scraper payload to Storage, returns its public URL"""
+
+    path = f"{post.get('id')}.json"
+
+    try:
+        raw_bucket.upload(
+            path,
+            orjson.dumps(post),
+            file_options={
+                'content-type': 'application/json',
+                'upsert': 'true'
+            }
+        )
+        return raw_bucket.get_public_url(path)
+    except Exception as e:
+        print(f"  ❌ Error uploading raw JSON for {post.get('id')}: {e}")
+        return None
+
+def upload_raw_posts(raw_bucket, posts):
+    """Upload payloads in parallel, returns {post_id: public_url} for the ones that were stored"""
+
+    if not posts:
+        return {}
+
+    print(f"  ☁️  Uploading {len(posts)} raw posts to Storage...")
+    with ThreadPoolExecutor(max_workers=RAW_UPLOAD_WORKERS) as executor:
+        raw_urls = executor.map(lambda post: upload_raw_json(raw_bucket, post), posts)
+        return {post.get('id'): raw_url for post, raw_url in zip(posts, raw_urls) if raw_url}
+
 def import_instagram_data(json_file):
     """Import Instagram data from JSON file to Supabase"""
 
     # Initialize Supabase client
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase: Client = create_client(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        options=ClientOptions(httpx_client=httpx.Client(
+            transport=GzipTransport(retries=3) if POSTGREST_GZIP else httpx.HTTPTransport(retries=3),
+            timeout=120
+        ))
+    )
 
     print(f"📂 Loading data from {json_file}...")
 
     # Load JSON data
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    with open(json_file, 'rb') as f:
+        data = orjson.loads(f.read())
 
     # Filter for carousels only (type = 'Sidecar')
     carousels = [p for p in data if p.get('type') == 'Sidecar']
 
     print(f"🎠 Found {len(carousels)} carousels to import\n")
 
-    imported_count = 0
-    skipped_count = 0
+    carousel_rows = []
+    image_rows = []
+    posts_by_id = {}
 
     for i, post in enumerate(carousels, 1):
         post_id = post.get('id')
@@ -41,69 +260,77 @@ def import_instagram_data(json_file):
         print(f"[{i}/{len(carousels)}] Processing carousel {post_id}...")
 
         try:
-            # Check if carousel already exists
-            existing = supabase.table('instagram_carousels').select('id').eq('post_id', post_id).execute()
-
-            if existing.data:
-                print(f"  ⏭️  Skipped (already exists)")
-                skipped_count += 1
-                continue
-
             # Parse timestamp
             posted_at = None
             if post.get('timestamp'):
                 try:
-                    posted_at = datetime.fromisoformat(post.get('timestamp').replace('Z', '+00:00')).isoformat()
-                except:
+                    posted_at = ciso8601.parse_datetime(post.get('timestamp')).isoformat()
+                except ValueError:
                     pass
 
             # Count images in carousel
             child_posts = post.get('childPosts', [])
             image_count = sum(1 for child in child_posts if child.get('type') == 'Image')
 
-            # Insert carousel
-            carousel_data = {
+            # Queue carousel for bulk insert (id generated here so images can reference it)
+            carousel_db_id = str(uuid.uuid4())
+            carousel_rows.append({
+                'id': carousel_db_id,
                 'post_id': post_id,
                 'username': username,
                 'caption': post.get('caption', ''),
                 'likes_count': post.get('likesCount', 0),
                 'comments_count': post.get('commentsCount', 0),
                 'posted_at': posted_at,
-                'image_count': image_count,
-                'raw_data': post
-            }
-
-            result = supabase.table('instagram_carousels').insert(carousel_data).execute()
-            carousel_db_id = result.data[0]['id']
+                'image_count': image_count
+            })
+            posts_by_id.setdefault(post_id, post)
 
-            print(f"  ✓ Carousel created (DB ID: {carousel_db_id[:8]}...)")
-
-            # Insert carousel images
-            images_inserted = 0
             for order, child in enumerate(child_posts, 1):
                 if child.get('type') == 'Image':
-                    image_data = {
+                    image_rows.append({
                         'carousel_id': carousel_db_id,
                         'image_url': child.get('displayUrl'),
                         'image_order': order,
                         'width': child.get('width'),
                         'height': child.get('height')
-                    }
-
-                    supabase.table('carousel_images').insert(image_data).execute()
-                    images_inserted += 1
-
-            print(f"  ✓ {images_inserted} images added")
-            imported_count += 1
+                    })
 
         except Exception as e:
             print(f"  ❌ Error: {e}")
             continue
 
+    # Raw payloads go to Storage (rows only keep the URL), uploaded once Postgres has
+    # said which carousels are new so re-imports don't rewrite existing payloads
+    try:
+        supabase.storage.create_bucket(RAW_JSON_BUCKET, options={'public': True})
+    except Exception as e:
+        if 'already exists' not in str(e).lower():
+            print(f"⚠️  Bucket creation note: {e}")
+
+    raw_bucket = supabase.storage.from_(RAW_JSON_BUCKET)
+
+    def store_raw(post_ids):
+        return upload_raw_posts(raw_bucket, [posts_by_id[post_id] for post_id in post_ids])
+
+    # Bulk load - COPY over a direct connection when available, PostgREST otherwise
+    if DIRECT_URL:
+        print(f"\n📥 Copying {len(carousel_rows)} carousels and {len(image_rows)} images...")
+        imported_count, failed_count = copy_rows(carousel_rows, image_rows, store_raw)
+    else:
+        print(f"\n📥 Inserting {len(carousel_rows)} carousels and {len(image_rows)} images...")
+        imported_count, failed_count = insert_rows(supabase, carousel_rows, image_rows, store_raw)
+
+    skipped_count = len(carousel_rows) - imported_count - failed_count
+
     print(f"\n{'='*60}")
-    print(f"✅ Import complete!")
+    if failed_count:
+        print(f"❌ Import finished with errors!")
+    else:
+        print(f"✅ Import complete!")
     print(f"  - Imported: {imported_count} carousels")
     print(f"  - Skipped: {skipped_count} (already in database)")
+    print(f"  - Failed: {failed_count}")
     print(f"  - Total in database: {imported_count + skipped_count}")
     print(f"{'='*60}")
 
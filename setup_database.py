@@ -29,7 +29,7 @@ tables = {
             posted_at TIMESTAMP,
             scraped_at TIMESTAMP DEFAULT NOW(),
             image_count INTEGER DEFAULT 0,
-            raw_data JSONB
+            raw_data_url TEXT
         );
     """,
 
@@ -58,6 +58,7 @@ tables = {
             completed_at TIMESTAMP,
             approved_at TIMESTAMP,
             notes TEXT,
+            prompt_hash TEXT,
             CONSTRAINT status_check CHECK (status IN ('pending', 'processing', 'completed', 'approved', 'rejected'))
         );
     """,
@@ -80,14 +81,33 @@ tables = {
     """
 }
 
-# Define indexes
-indexes = [
-    "CREATE INDEX IF NOT EXISTS idx_carousels_username ON instagram_carousels(username);",
-    "CREATE INDEX IF NOT EXISTS idx_carousels_posted_at ON instagram_carousels(posted_at DESC);",
-    "CREATE INDEX IF NOT EXISTS idx_images_carousel_id ON carousel_images(carousel_id);",
-    "CREATE INDEX IF NOT EXISTS idx_edit_tests_status ON edit_tests(status);",
-    "CREATE INDEX IF NOT EXISTS idx_edit_tests_carousel_id ON edit_tests(carousel_id);",
-    "CREATE INDEX IF NOT EXISTS idx_comfyui_batches_status ON comfyui_batches(status);"
+# Column changes after the first release (also applied to databases created before them)
+column_changes = [
+    "ALTER TABLE edit_tests ADD COLUMN IF NOT EXISTS prompt_hash TEXT;",
+    # Full scraper payloads live in the raw-json Storage bucket, rows only point at them
+    "ALTER TABLE instagram_carousels ADD COLUMN IF NOT EXISTS raw_data_url TEXT;"
+]
+
+# Define indexes (CONCURRENTLY so re-runs against a populated DB don't block writes).
+# An index whose definition changes gets a new name, so IF NOT EXISTS doesn't skip it
+indexes = {
+    "idx_carousels_username": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_carousels_username ON instagram_carousels(username);",
+    # Covering index - listing queries by date can be answered with index-only scans
+    "idx_carousels_posted_at_covering": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_carousels_posted_at_covering ON instagram_carousels(posted_at DESC) INCLUDE (username, likes_count);",
+    # Unique so imports can skip existing images with ON CONFLICT; also serves carousel_id lookups
+    "idx_images_carousel_order": "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_images_carousel_order ON carousel_images(carousel_id, image_order);",
+    # Partial index - only the small set of in-flight tests is indexed
+    "idx_edit_tests_status_active": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_edit_tests_status_active ON edit_tests(status) WHERE status IN ('pending', 'processing');",
+    "idx_edit_tests_carousel_id": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_edit_tests_carousel_id ON edit_tests(carousel_id);",
+    "idx_edit_tests_prompt_hash": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_edit_tests_prompt_hash ON edit_tests(prompt_hash);",
+    "idx_comfyui_batches_status": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comfyui_batches_status ON comfyui_batches(status);"
+}
+
+# Indexes replaced by the ones above - dropped once their replacements exist
+replaced_indexes = [
+    "idx_carousels_posted_at",  # -> idx_carousels_posted_at_covering
+    "idx_edit_tests_status",  # -> idx_edit_tests_status_active
+    "idx_images_carousel_id"  # -> idx_images_carousel_order (leading column)
 ]
 
 def setup_database():
@@ -96,28 +116,53 @@ def setup_database():
     print("🔧 Setting up Supabase database...\n")
 
     try:
-        with engine.connect() as conn:
+        # One transaction for tables/columns - commits once at the end, rolls back on any error
+        with engine.begin() as conn:
             # Create tables
             print("📊 Creating tables:")
             for table_name, create_sql in tables.items():
                 conn.execute(text(create_sql))
-                conn.commit()
                 print(f"  ✓ {table_name}")
 
+            # Apply column changes to existing tables
+            print("\n🧩 Updating columns:")
+            for column_sql in column_changes:
+                conn.execute(text(column_sql))
+                print(f"  ✓ Column updated")
+
+        # CREATE INDEX CONCURRENTLY is not allowed inside a transaction block
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would skip forever -
+            # drop it so it is rebuilt (and the build error, e.g. duplicate rows, is reported again)
+            invalid = conn.execute(text("""
+                SELECT c.relname
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE NOT i.indisvalid AND c.relname = ANY(:names)
+            """), {'names': list(indexes)}).scalars().all()
+            for index_name in invalid:
+                print(f"  ⚠️  Index {index_name} is INVALID (earlier build failed), rebuilding")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};"))
+
             # Create indexes
             print("\n🔍 Creating indexes:")
-            for index_sql in indexes:
+            for index_name, index_sql in indexes.items():
                 conn.execute(text(index_sql))
-                conn.commit()
-                print(f"  ✓ Index created")
+                print(f"  ✓ {index_name}")
 
-            print("\n✅ Database setup complete!")
-            print("\n📋 Tables created:")
-            print("  - instagram_carousels (stores scraped carousel data)")
-            print("  - carousel_images (individual images from carousels)")
-            print("  - edit_tests (NanaBanana test results & approval status)")
-            print("  - comfyui_batches (batch processing jobs)")
+            # Drop the indexes they replace
+            for index_name in replaced_indexes:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};"))
+                print(f"  ✓ Dropped {index_name} (replaced)")
 
+        print("\n✅ Database setup complete!")
+        print("\n📋 Tables created:")
+        print("  - instagram_carousels (stores scraped carousel data)")
+        print("  - carousel_images (individual images from carousels)")
+        print("  - edit_tests (NanaBanana test results & approval status)")
+        print("  - comfyui_batches (batch processing jobs)")
+
+        with engine.connect() as conn:
             # Verify tables exist
             print("\n🔍 Verifying tables...")
             result = conn.execute(text("""
@@ -4,8 +4,11 @@ Generate AI-safe variation suggestions for Instagram carousels using Grok-2-Visi
 """
 import os
 import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv('.env.local')
@@ -13,6 +16,13 @@ load_dotenv('.env.local')
 GROK_API_KEY = os.getenv('GROK_API_KEY')
 GROK_API_URL = "https://api.x.ai/v1/chat/completions"
 
+# Grok requests in flight at once
+GROK_MAX_CONCURRENCY = 4
+
+# Keep-alive session - reuses TCP/TLS connections across requests
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 SYSTEM_PROMPT = """You are helping generate AI-safe variations of an Instagram influencer named Blondie.
 We are recreating each carousel with only subtle stylistic changes so the resulting content feels inspired by the original but does not duplicate it.
 Do NOT change the pose, body shape, skin tone, hairstyle, lighting, or composition.
@@ -108,7 +118,7 @@ def call_grok_vision(post_id, caption, image_urls):
     }
 
     try:
-        response = requests.post(GROK_API_URL, json=payload, headers=headers, timeout=60)
+        response = session.post(GROK_API_URL, data=orjson.dumps(payload), headers=headers, timeout=60)
         response.raise_for_status()
 
         result = response.json()
@@ -121,7 +131,7 @@ def call_grok_vision(post_id, caption, image_urls):
         elif "```" in message:
             message = message.split("```")[1].split("```")[0].strip()
 
-        return json.loads(message)
+        return orjson.loads(message)
 
     except requests.exceptions.RequestException as e:
         print(f"❌ API request failed: {e}")
@@ -139,8 +149,8 @@ def process_carousels(input_file, output_file, limit=2):
 
     print(f"📂 Loading scrape data from: {input_file}")
 
-    with open(input_file, 'r') as f:
-        data = json.load(f)
+    with open(input_file, 'rb') as f:
+        data = orjson.loads(f.read())
 
     # Filter for carousels only
     carousels = [p for p in data if p.get('type') == 'Sidecar']
@@ -150,7 +160,7 @@ def process_carousels(input_file, output_file, limit=2):
         carousels = carousels[:limit]
         print(f"🔬 Testing with first {limit} carousels")
 
-    results = []
+    jobs = []
 
     for i, carousel in enumerate(carousels, 1):
         post_id = carousel.get('id')
@@ -167,28 +177,34 @@ def process_carousels(input_file, output_file, limit=2):
             image_urls = [carousel.get('displayUrl')]
 
         print(f"\n{'='*60}")
-        print(f"Processing carousel {i}/{len(carousels)}")
+        print(f"Queued carousel {i}/{len(carousels)}")
         print(f"Post ID: {post_id}")
         print(f"Caption: {caption[:80]}...")
         print(f"Images: {len(image_urls)}")
         print(f"{'='*60}")
 
-        # Call Grok API
-        print("🤖 Calling Grok-2-Vision API...")
-        suggestion = call_grok_vision(post_id, caption, image_urls)
+        jobs.append((post_id, caption, image_urls))
 
+    # Call Grok API for several carousels at once (kept low to stay within rate limits)
+    print(f"\n🤖 Calling Grok-2-Vision API ({GROK_MAX_CONCURRENCY} at a time)...")
+
+    with ThreadPoolExecutor(max_workers=GROK_MAX_CONCURRENCY) as executor:
+        suggestions = list(executor.map(lambda job: call_grok_vision(*job), jobs))
+
+    results = []
+    for (post_id, caption, image_urls), suggestion in zip(jobs, suggestions):
         if suggestion:
             results.append(suggestion)
-            print("✅ Got suggestions!")
+            print(f"✅ Got suggestions for {post_id}!")
         else:
-            print("⚠️  Failed to get suggestions for this carousel")
+            print(f"⚠️  Failed to get suggestions for carousel {post_id}")
 
     # Save results
     print(f"\n💾 Saving results to: {output_file}")
     os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else '.', exist_ok=True)
 
-    with open(output_file, 'w') as f:
-        json.dump(results, f, indent=2)
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
     print(f"✅ Done! Processed {len(results)}/{len(carousels)} carousels")
     print(f"📄 Output saved to: {output_file}")
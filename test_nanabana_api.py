@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 from supabase import create_client
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 
@@ -14,6 +15,10 @@ load_dotenv('.env.local')
 WAVESPEED_API_KEY = os.getenv('WAVESPEED_API_KEY')
 WAVESPEED_API_URL = os.getenv('WAVESPEED_API_URL')
 
+# Keep-alive session - reuses TCP/TLS connections across requests
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 # Get one test image from Supabase
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
@@ -23,7 +28,7 @@ print("🧪 Testing WaveSpeed NanaBanana Pro API\n")
 print("="*60)
 
 # Get a test image
-result = supabase.table('carousel_images').select('*').not_.is_('local_path', 'null').limit(1).execute()
+result = supabase.table('carousel_images').select('id,local_path').not_.is_('local_path', 'null').limit(1).execute()
 if not result.data:
     print("❌ No images found in database")
     exit(1)
@@ -61,7 +66,7 @@ print(f"Payload: {json.dumps(payload, indent=2)}\n")
 
 try:
     # Make API request
-    response = requests.post(
+    response = session.post(
         WAVESPEED_API_URL,
         json=payload,
         headers=headers,
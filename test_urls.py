@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """Test if Instagram image URLs are still accessible"""
 from supabase import create_client
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import requests
 
@@ -11,22 +14,41 @@ SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Keep-alive session - HEADs to the same CDN reuse one connection
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.3)))
+
 # Get first 3 image URLs
 result = supabase.table('carousel_images').select('image_url').limit(3).execute()
 
 print("Testing Instagram image URLs...\n")
 
-for i, img in enumerate(result.data, 1):
-    url = img['image_url']
-    print(f"{i}. Testing URL: {url[:80]}...")
 
+def check_url(url):
+    """HEAD one URL - returns (status_code, error)"""
     try:
-        response = requests.head(url, timeout=10)
-        print(f"   Status: {response.status_code}")
-        if response.status_code == 200:
-            print(f"   ✓ OK")
-        else:
-            print(f"   ✗ BROKEN")
+        response = session.head(url, timeout=10, allow_redirects=False)
+        return response.status_code, None
     except Exception as e:
-        print(f"   ✗ ERROR: {e}")
-    print()
+        return None, e
+
+
+# Check all URLs in parallel, report as each one finishes
+with ThreadPoolExecutor(max_workers=32) as executor:
+    futures = {executor.submit(check_url, img['image_url']): i for i, img in enumerate(result.data, 1)}
+
+    for future in as_completed(futures):
+        i = futures[future]
+        url = result.data[i - 1]['image_url']
+        status_code, error = future.result()
+
+        print(f"{i}. Testing URL: {url[:80]}...")
+        if error:
+            print(f"   ✗ ERROR: {error}")
+        else:
+            print(f"   Status: {status_code}")
+            if status_code == 200:
+                print(f"   ✓ OK")
+            else:
+                print(f"   ✗ BROKEN")
+        print()